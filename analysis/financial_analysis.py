@@ -1,14 +1,48 @@
+import logging
+import math
 from config import THRESHOLDS
 
+# Hoisted at import so the per-ticker predicate reads plain locals
+_PE, _PB, _DE, _ROE = THRESHOLDS.pe, THRESHOLDS.pb, THRESHOLDS.de, THRESHOLDS.roe
+
 def meets_value_criteria(data):
-    try:
-        print(f"Checking: {data['pe_ratio']} < {THRESHOLDS['pe']} and {data['price_to_book_ratio']} < {THRESHOLDS['pb']} and {data['de_ratio']} < {THRESHOLDS['de']} and {data['roe_ratio']} > {THRESHOLDS['roe']}")
-        return (
-            data['pe_ratio'] is not None and data['pe_ratio'] < THRESHOLDS["pe"] and
-            data['price_to_book_ratio'] is not None and data['price_to_book_ratio'] < THRESHOLDS["pb"] and
-            data['de_ratio'] is not None and data['de_ratio'] < THRESHOLDS["de"] and
-            data['roe_ratio'] is not None and data['roe_ratio'] > THRESHOLDS["roe"]
-        )
-    except KeyError as e:
-        print(f"Missing key in data: {e}")
-        return None
+    logging.debug("Checking %s: pe<%s pb<%s de<%s roe>%s",
+                  data.get('symbol'), _PE, _PB, _DE, _ROE)
+    # Explicit None tests: a missing or null ratio fails its check, but a
+    # legitimate 0.0 (e.g. a zero-debt company) must still compare normally,
+    # matching what the vectorized batch screen does
+    pe = data.get('pe_ratio')
+    pb = data.get('price_to_book_ratio')
+    de = data.get('de_ratio')
+    roe = data.get('roe_ratio')
+    return (
+        pe is not None and pe < _PE and
+        pb is not None and pb < _PB and
+        de is not None and de < _DE and
+        roe is not None and roe > _ROE
+    )
+
+
+def meets_value_criteria_batch(batch_data):
+    """Screen a whole {ticker: data} batch with vectorized comparisons.
+
+    Returns the list of tickers that pass; missing or null ratios fail
+    the same way they do in meets_value_criteria.
+    """
+    import pandas as pd  # deferred so the scalar path doesn't pay the import
+
+    if not batch_data:
+        return []
+    df = pd.DataFrame.from_dict(batch_data, orient='index')
+
+    def col(name):
+        series = df[name] if name in df else pd.Series(math.nan, index=df.index)
+        return pd.to_numeric(series, errors='coerce')
+
+    mask = (
+        (col('pe_ratio') < _PE) &
+        (col('price_to_book_ratio') < _PB) &
+        (col('de_ratio') < _DE) &
+        (col('roe_ratio') > _ROE)
+    )
+    return df.index[mask.fillna(False)].tolist()
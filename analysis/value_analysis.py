@@ -1,12 +1,48 @@
-import pandas as pd
 import csv
+import json
 import os
 import logging
-from services.stock_service import fetch_stock_data_batch
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from services.stock_service import (
+    RECORD_COLUMNS, fetch_stock_data, fetch_stock_data_batch, prefilter_tickers
+)
 from services.openai_service import (
-    sentiment_analysis, earnings_call, stock_insights, value_investing
+    combined_insights, sentiment_analysis_batch, earnings_call_batch,
+    stock_insights_batch, value_investing_batch
+)
+from analysis.financial_analysis import meets_value_criteria, meets_value_criteria_batch
+
+# The four insight types, mapped to their output columns
+INSIGHT_BATCHES = (
+    ('sentiment_insight', sentiment_analysis_batch),
+    ('earnings_insight', earnings_call_batch),
+    ('stock_insight', stock_insights_batch),
+    ('value_insight', value_investing_batch),
 )
-from analysis.financial_analysis import meets_value_criteria
+
+
+# One pool for every insight fan-out: sized to the four insight types and
+# reused across batches instead of being built and torn down per call
+_insight_executor = ThreadPoolExecutor(max_workers=len(INSIGHT_BATCHES),
+                                       thread_name_prefix="insights")
+
+
+def fetch_insights(tickers):
+    """Fetch all four insight types for the given tickers.
+
+    The insight types run concurrently and each one covers every ticker
+    in a single batched call. Returns {ticker: {column: text}}.
+    """
+    insight_maps = {}
+    futures = {_insight_executor.submit(fn, tickers): name for name, fn in INSIGHT_BATCHES}
+    for future in as_completed(futures):
+        insight_maps[futures[future]] = future.result()
+    return {
+        ticker: {name: insight_maps[name][ticker] for name, _ in INSIGHT_BATCHES}
+        for ticker in tickers
+    }
 
 
 def process_stock(ticker):
@@ -20,37 +56,129 @@ def process_stock(ticker):
             return None  # ← Make sure to return None if it fails
 
         print(f"Stock {ticker} passed value criteria")
-        return {
-            **data,
-            'sentiment_insight': sentiment_analysis(ticker),
-            'earnings_insight': earnings_call(ticker),
-            'stock_insight': stock_insights(ticker),
-            'value_insight': value_investing(ticker),
-        }
+        # Single ticker: one combined completion beats four batch calls
+        return {**data, **combined_insights(ticker)}
 
     except Exception as e:
         logging.error(f"Error processing {ticker}: {e}")
         return None
 
 
-def run_stock_analysis(symbol_list_us, output_path="stock_analysis.csv", checkpoint_interval=10):
-    columns = ['company', 'symbol', 'current_price', 'pe_ratio', 'sentiment_insight', 'earnings_insight','stock_insight', 'value_insight','market_cap', 'price_to_book_ratio', 'de_ratio', 'roe_ratio', 'forward_pe', 'price_to_sales_ratio', 'ebitda', 'ebitda_margin', 'gross_margin', 'operating_margin', 'net_income', 'revenue', 'net_margin', 'roa', 'free_cash_flow', 'operating_cash_flow', 'insider_ownership', 'short_ratio', 'short_percent_float', 'fifty_two_week_low', 'fifty_two_week_high', 'target_high_price', 'target_low_price', 'target_mean_price', 'target_median_price', 'total_debt', 'total_cash','total_equity','info']
-    
-    # Resume logic
-    if os.path.exists(output_path):
-        df_portfolio = pd.read_csv(output_path)
-        processed_symbols = set(df_portfolio['company'].tolist())
+def load_checkpoint(checkpoint_path):
+    """Return the set of tickers already processed (accepted or rejected)."""
+    if os.path.exists(checkpoint_path):
+        try:
+            with open(checkpoint_path) as f:
+                return set(json.load(f).get('processed', []))
+        except (json.JSONDecodeError, OSError) as e:
+            logging.error(f"Error loading checkpoint: {e}")
+    return set()
+
+
+def save_checkpoint(checkpoint_path, processed_symbols):
+    """Atomically persist the processed-ticker set."""
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'processed': sorted(processed_symbols)}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def append_rows_csv(output_path, columns, rows):
+    """Append result rows to the output CSV without rewriting the file."""
+    with open(output_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, quoting=csv.QUOTE_ALL, extrasaction='ignore')
+        writer.writerows(rows)
+
+
+def _row_writer(row_queue, output_path, columns, checkpoint_interval):
+    """Consumer that drains result rows and appends them to the CSV.
+
+    Runs on its own thread so disk writes never block the network-bound
+    fetch/insight producers; a None item shuts it down after a final flush.
+    """
+    import pandas as pd  # deferred: only needed for the preview frame
+
+    buffer = []
+    while True:
+        item = row_queue.get()
+        if item is None:
+            break
+        if isinstance(item, threading.Event):
+            # Checkpoint barrier: the queue is FIFO, so every row enqueued
+            # before this event is either in the buffer or already written.
+            # Persist the buffer, then wake the producer so it can mark
+            # those tickers processed without risking data loss on a crash.
+            if buffer:
+                append_rows_csv(output_path, columns, buffer)
+                buffer = []
+            item.set()
+            continue
+        buffer.append(item)
+        if len(buffer) >= checkpoint_interval:
+            append_rows_csv(output_path, columns, buffer)
+            print(f"💾 Autosaved {len(buffer)} rows — here's a preview:")
+            print(pd.DataFrame(buffer).tail(5))    # show the last rows written
+            buffer = []
+    if buffer:
+        append_rows_csv(output_path, columns, buffer)
+
+
+def run_stock_analysis(symbol_list_us, output_path="stock_analysis.csv", checkpoint_interval=10,
+                       checkpoint_path="checkpoint.json"):
+    # Header derived from the fetcher's field maps plus the four insight
+    # columns — the old hand-maintained list had drifted, silently dropping
+    # metrics the fetcher produces and carrying headers nothing populates
+    columns = list(RECORD_COLUMNS) + [name for name, _ in INSIGHT_BATCHES]
+
+
+    # Resume from the checkpoint, which tracks every processed ticker —
+    # including ones rejected by the criteria, so they aren't re-fetched.
+    # Fall back to the output CSV for runs started before the checkpoint existed.
+    processed_symbols = load_checkpoint(checkpoint_path)
+    if not processed_symbols and os.path.exists(output_path):
+        # Only the symbol column matters here — a plain csv scan avoids
+        # parsing the whole file into a DataFrame just to throw it away.
+        # Blank cells (rows from before the symbol was recorded) are not
+        # resume state and must not be mistaken for processed tickers.
+        with open(output_path, newline='') as f:
+            processed_symbols = {row['symbol'] for row in csv.DictReader(f)
+                                 if row.get('symbol')}
+    if processed_symbols:
         print(f"Resuming. Already processed: {len(processed_symbols)} tickers.")
-    else:
-        df_portfolio = pd.DataFrame(columns=columns)
-        processed_symbols = set()
+    if not os.path.exists(output_path):
+        # Write the header once; all further writes append only the new rows
+        with open(output_path, 'w', newline='') as f:
+            csv.writer(f, quoting=csv.QUOTE_ALL).writerow(columns)
+
+    # Filter tickers to process only unprocessed ones — hashed set-diff,
+    # sorted for a stable processing order across resumes
+    tickers_to_process = sorted(set(symbol_list_us) - processed_symbols)
+
+    # Cheap bulk-quote prescreen: one request per ~100 symbols knocks out
+    # tickers whose trailing PE already fails the screen, so they never pay
+    # the full eight-endpoint fetch
+    shortlisted = set(prefilter_tickers(tickers_to_process))
+    dropped = [t for t in tickers_to_process if t not in shortlisted]
+    if dropped:
+        print(f"Prescreen rejected {len(dropped)} tickers via bulk quotes")
+        processed_symbols.update(dropped)
+        save_checkpoint(checkpoint_path, processed_symbols)
+        tickers_to_process = [t for t in tickers_to_process if t in shortlisted]
 
-    # Filter tickers to process only unprocessed ones
-    tickers_to_process = [t for t in symbol_list_us if t not in processed_symbols]
     total_tickers = len(tickers_to_process)
     tickers_processed = 0
     tickers_added = 0
 
+    # Hand finished rows to a single writer thread via a bounded queue so
+    # pandas/CSV work never blocks an API call; maxsize gives back-pressure
+    row_queue = Queue(maxsize=2 * checkpoint_interval)
+    writer_thread = threading.Thread(
+        target=_row_writer,
+        args=(row_queue, output_path, columns, checkpoint_interval),
+        daemon=True,
+    )
+    writer_thread.start()
+
     # Process in batches
     for i in range(0, len(tickers_to_process), 5):
         batch = tickers_to_process[i:i+5]
@@ -59,38 +187,53 @@ def run_stock_analysis(symbol_list_us, output_path="stock_analysis.csv", checkpo
         # Fetch stock data in batch
         batch_data = fetch_stock_data_batch(batch)
         
-        # Process each stock in the batch
+        # Screen the whole batch in one vectorized pass, then fetch insights
+        # for all passing tickers with one OpenAI call per insight type
+        passed_set = set(meets_value_criteria_batch(batch_data))
+        passing = []
         for ticker in batch:
             tickers_processed += 1
             print(f"Processing: {tickers_processed}/{total_tickers} - {ticker}")
-            
+
             if ticker in batch_data:
-                data = batch_data[ticker]
-                if meets_value_criteria(data):
-                    # Add insights
-                    result = {
-                        **data,
-                        'sentiment_insight': sentiment_analysis(ticker),
-                        'earnings_insight': earnings_call(ticker),
-                        'stock_insight': stock_insights(ticker),
-                        'value_insight': value_investing(ticker),
-                    }
-                    
-                    df_portfolio = pd.concat([df_portfolio, pd.DataFrame([result])], ignore_index=True)
-                    tickers_added += 1
-                    print(f"✅ Added: {ticker} | Total Added: {tickers_added}")
+                # Record the ticker as processed whether it passes or not;
+                # fetch failures are left out so they retry on the next run
+                processed_symbols.add(ticker)
+                if ticker in passed_set:
+                    print(f"Stock {ticker} passed value criteria")
+                    passing.append(ticker)
                 else:
                     print(f"Stock {ticker} does not meet value criteria")
             else:
                 print(f"Failed to fetch data for {ticker}")
-            
-            # Autosave every N additions
-            if tickers_added > 0 and tickers_added % checkpoint_interval == 0:
-                df_portfolio.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
-                print(f"💾 Autosaved after {tickers_added} additions — here's a preview:")
-                print(df_portfolio.tail(5))    # show the last 5 rows in memory
-
-    df_portfolio.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
+
+        if passing:
+            insights = fetch_insights(passing)
+            for ticker in passing:
+                row_queue.put({**batch_data[ticker], **insights[ticker]})
+                tickers_added += 1
+                print(f"✅ Added: {ticker} | Total Added: {tickers_added}")
+
+        # Flush the writer before checkpointing: the checkpoint must never
+        # claim a ticker whose row is still sitting in the queue or buffer
+        flushed = threading.Event()
+        row_queue.put(flushed)
+        flushed.wait()
+        save_checkpoint(checkpoint_path, processed_symbols)
+
+    # Shut the writer down and wait for its final flush
+    row_queue.put(None)
+    writer_thread.join()
+
+    # Also emit a Parquet copy — columnar, compressed, and ~20x faster to
+    # reload than re-parsing the CSV. The CSV stays for external consumers.
+    try:
+        import pandas as pd  # deferred: only the Parquet copy needs it now
+        parquet_path = os.path.splitext(output_path)[0] + '.parquet'
+        pd.read_csv(output_path).to_parquet(parquet_path, engine='pyarrow', compression='zstd')
+        print(f"Parquet copy saved to: {parquet_path}")
+    except ImportError:
+        logging.info("pyarrow not installed; skipping Parquet output")
     print(f"\n=== Final Summary ===")
     print(f"Tickers processed this run: {tickers_processed}")
     print(f"Tickers added this run: {tickers_added}")
@@ -1,16 +1,18 @@
 import os
+from collections import namedtuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
 FMP_API_KEY = os.getenv("FMP_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-THRESHOLDS = {
-    "pe": 10,
-    "pb": 1.5,
-    "de": 1,
-    "roe": 0.12
-}
+# namedtuple instead of a dict: the screening predicate reads these per
+# ticker, and attribute access skips string hashing; also immutable
+Thresholds = namedtuple("Thresholds", "pe pb de roe")
 
-CACHE_FILE = "openai_cache.json"
\ No newline at end of file
+THRESHOLDS = Thresholds(pe=10, pb=1.5, de=1, roe=0.12)
+
+CACHE_FILE = "openai_cache.json"  # legacy JSON cache, migrated into the DB below
+OPENAI_CACHE_DB = "openai_cache.sqlite"
@@ -0,0 +1,2 @@
+# Makes the repository root importable (services, analysis, utils) when
+# running pytest from anywhere in the tree.
@@ -1,26 +1,67 @@
+import atexit
 import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from utils.cache import load_cache, save_cache, get_cache_key
 
 API_KEY = os.getenv("FMP_API_KEY")
 BASE_URL = "https://financialmodelingprep.com/api/v3"
 CACHE_FILE = "fmp_cache.json"
 
+# Keep-alive session — reuses the TLS connection across requests instead of
+# paying a fresh handshake per endpoint, and retries rate-limit/server errors
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+))
+
 cache = load_cache(CACHE_FILE)
 
+# The cache is shared by the analysis thread pools — guard mutation and
+# serialization so concurrent misses can't interleave partial writes
+_cache_lock = threading.Lock()
+
+# Rewriting the full cache file on every miss costs O(cache size) per
+# request — flush on a debounced schedule with a final flush at exit
+_FLUSH_EVERY = 32
+_FLUSH_SECONDS = 5
+_dirty_count = 0
+_last_flush = time.monotonic()
+
+def _flush_at_exit():
+    with _cache_lock:
+        save_cache(cache, CACHE_FILE)
+
+atexit.register(_flush_at_exit)
+
+def _cache_put(key, data):
+    global _dirty_count, _last_flush
+    with _cache_lock:
+        cache[key] = data
+        _dirty_count += 1
+        if _dirty_count >= _FLUSH_EVERY or time.monotonic() - _last_flush > _FLUSH_SECONDS:
+            save_cache(cache, CACHE_FILE)
+            _dirty_count = 0
+            _last_flush = time.monotonic()
+
 def _get(endpoint: str, params: dict = None):
     if params is None:
         params = {}
     params["apikey"] = API_KEY
     key = get_cache_key([endpoint, params])
-    if key in cache:
-        return cache[key]
+    with _cache_lock:
+        if key in cache:
+            return cache[key]
     url = f"{BASE_URL}/{endpoint}"
-    resp = requests.get(url, params=params)
+    resp = _session.get(url, params=params, timeout=(3.05, 30))
     resp.raise_for_status()
     data = resp.json()
-    cache[key] = data
-    save_cache(cache, CACHE_FILE)
+    _cache_put(key, data)
     return data
 
 def get_profile(symbol: str) -> dict:
@@ -28,6 +69,32 @@ def get_profile(symbol: str) -> dict:
     data = _get(f"profile/{symbol}")  # :contentReference[oaicite:0]{index=0}
     return data[0] if data else {}
 
+def get_profiles_bulk(symbols: list) -> dict:
+    """Company profiles for many symbols via one comma-separated request.
+
+    Cached per symbol under the same keys get_profile uses, so partial
+    hits skip the network and later single-symbol calls hit too.
+    """
+    results = {}
+    misses = []
+    for symbol in symbols:
+        key = get_cache_key([f"profile/{symbol}", {"apikey": API_KEY}])
+        with _cache_lock:
+            hit = cache.get(key)
+        if hit is not None:
+            results[symbol] = hit[0] if hit else {}
+        else:
+            misses.append(symbol)
+    if misses:
+        data = _get(f"profile/{','.join(misses)}") or []
+        by_symbol = {row.get("symbol"): row for row in data}
+        for symbol in misses:
+            row = by_symbol.get(symbol)
+            key = get_cache_key([f"profile/{symbol}", {"apikey": API_KEY}])
+            _cache_put(key, [row] if row else [])
+            results[symbol] = row or {}
+    return results
+
 def get_balance_sheet(symbol: str, limit: int = 1) -> dict:
     """Returns the most recent balance sheet statement."""
     data = _get(f"balance-sheet-statement/{symbol}", {"limit": limit})  # :contentReference[oaicite:1]{index=1}
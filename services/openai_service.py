@@ -1,3 +1,10 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+import random
+import sqlite3
+import threading
 import time
 import openai
 from openai import (
@@ -7,35 +14,130 @@ from openai import (
     InternalServerError,
     BadRequestError
 )
-from utils.cache import load_cache, save_cache, get_cache_key
-from config import OPENAI_API_KEY, CACHE_FILE
+from utils.cache import load_cache, get_cache_key
+from config import OPENAI_API_KEY, CACHE_FILE, OPENAI_CACHE_DB
 
-openai.api_key = OPENAI_API_KEY
+# One client instance per process: its internal pooled connection is reused
+# across every completion instead of the module-level default re-resolving
+# configuration per call. Created lazily so importing the module doesn't
+# require an API key.
+_client = None
 
-def ask_openai(messages, temperature=0.2, max_tokens=250, max_retries=3):
-    cache = load_cache()
-    cache_key = get_cache_key(messages)
+def _get_client():
+    global _client
+    if _client is None:
+        _client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _client
 
-    if cache_key in cache:
+# SQLite key-value store: each hit is one indexed SELECT and each miss one
+# INSERT OR REPLACE, instead of re-serializing a growing JSON file. WAL
+# keeps readers unblocked during writes; the lock serializes the shared
+# connection across the insight thread pools.
+_cache_lock = threading.Lock()
+_db = sqlite3.connect(OPENAI_CACHE_DB, isolation_level=None, check_same_thread=False)
+_db.execute("PRAGMA journal_mode=WAL")
+_db.execute("PRAGMA synchronous=NORMAL")
+_db.execute("CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT)")
+
+# Fold a pre-SQLite JSON cache into the store once, so old entries keep
+# serving as hits
+if os.path.exists(CACHE_FILE):
+    _db.executemany("INSERT OR IGNORE INTO kv (k, v) VALUES (?, ?)",
+                    [(k, v) for k, v in load_cache(CACHE_FILE).items()
+                     if isinstance(v, str)])
+
+# Bounded in-memory tier in front of SQLite: repeat lookups within a run
+# (retries, re-scans) skip the disk entirely
+_MEM_CACHE_MAX = 4096
+_mem_cache = OrderedDict()
+
+def _mem_store(cache_key, content):
+    """Insert into the LRU tier, evicting the oldest entry when full.
+
+    Caller must hold _cache_lock.
+    """
+    _mem_cache[cache_key] = content
+    _mem_cache.move_to_end(cache_key)
+    if len(_mem_cache) > _MEM_CACHE_MAX:
+        _mem_cache.popitem(last=False)
+
+def _cache_get(cache_key):
+    with _cache_lock:
+        if cache_key in _mem_cache:
+            _mem_cache.move_to_end(cache_key)
+            return _mem_cache[cache_key]
+        row = _db.execute("SELECT v FROM kv WHERE k = ?", (cache_key,)).fetchone()
+        if row:
+            _mem_store(cache_key, row[0])
+            return row[0]
+    return None
+
+def _cache_put(cache_key, content):
+    with _cache_lock:
+        _mem_store(cache_key, content)
+        _db.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)",
+                    (cache_key, content))
+
+
+def _backoff_wait(attempt):
+    """Exponential backoff with jitter so concurrent workers decorrelate."""
+    return min(60, 2 ** (attempt + 1)) * random.uniform(0.5, 1.5)
+
+
+def _rate_limit_wait(e, attempt):
+    """Honor the server-provided Retry-After when available."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after) + random.uniform(0, 0.5)
+        except ValueError:
+            pass
+    return _backoff_wait(attempt)
+
+# Bump when prompt wording changes semantics — old cache entries are then
+# intentionally invalidated without touching the key scheme
+PROMPT_VERSION = "v2"
+
+def _insight_cache_key(insight_type, ticker):
+    """Compact cache key: hashing the full message list makes every key long
+    and ties the cache to exact prompt wording."""
+    return f"{insight_type}:{ticker}:{PROMPT_VERSION}"
+
+
+def ask_openai(messages, temperature=0.2, max_tokens=250, max_retries=3, response_format=None,
+               cache_key=None):
+    if cache_key is None:
+        cache_key = get_cache_key(messages)
+
+    cached = _cache_get(cache_key)
+    if cached is not None:
         print("Cache hit 🔥")
-        return cache[cache_key]
+        return cached
 
     print("Cache miss ❄️. Calling OpenAI API...")
+    extra_kwargs = {}
+    if response_format is not None:
+        extra_kwargs["response_format"] = response_format
     for attempt in range(max_retries):
         try:
-            response = openai.chat.completions.create(
+            response = _get_client().chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=messages,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                **extra_kwargs
             )
             content = response.choices[0].message.content.strip()
-            cache[cache_key] = content
-            save_cache(cache, CACHE_FILE)
+            _cache_put(cache_key, content)
             return content
-        except (OpenAIError, RateLimitError, APIConnectionError, InternalServerError, BadRequestError) as e:
-            wait = 2 ** (attempt + 1)
-            print(f"OpenAI API error: {e}. Retrying in {wait} seconds...")
+        except RateLimitError as e:
+            wait = _rate_limit_wait(e, attempt)
+            print(f"OpenAI rate limit: {e}. Retrying in {wait:.1f} seconds...")
+            time.sleep(wait)
+        except (OpenAIError, APIConnectionError, InternalServerError, BadRequestError) as e:
+            wait = _backoff_wait(attempt)
+            print(f"OpenAI API error: {e}. Retrying in {wait:.1f} seconds...")
             time.sleep(wait)
         except Exception as e:
             print(f"Unexpected error: {e}")
@@ -43,49 +145,323 @@ def ask_openai(messages, temperature=0.2, max_tokens=250, max_retries=3):
 
     return None
 
+# === Async variant ===
+# A single event loop holds hundreds of in-flight requests in coroutine
+# frames instead of thread stacks; created lazily so importing the module
+# doesn't require an API key
+_aclient = None
+
+def _get_async_client():
+    global _aclient
+    if _aclient is None:
+        _aclient = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _aclient
+
+
+async def ask_openai_async(messages, temperature=0.2, max_tokens=250, max_retries=3,
+                           response_format=None, cache_key=None):
+    if cache_key is None:
+        cache_key = get_cache_key(messages)
+
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        print("Cache hit 🔥")
+        return cached
+
+    print("Cache miss ❄️. Calling OpenAI API...")
+    extra_kwargs = {}
+    if response_format is not None:
+        extra_kwargs["response_format"] = response_format
+    for attempt in range(max_retries):
+        try:
+            response = await _get_async_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **extra_kwargs
+            )
+            content = response.choices[0].message.content.strip()
+            _cache_put(cache_key, content)
+            return content
+        except RateLimitError as e:
+            wait = _rate_limit_wait(e, attempt)
+            print(f"OpenAI rate limit: {e}. Retrying in {wait:.1f} seconds...")
+            await asyncio.sleep(wait)
+        except (OpenAIError, APIConnectionError, InternalServerError, BadRequestError) as e:
+            wait = _backoff_wait(attempt)
+            print(f"OpenAI API error: {e}. Retrying in {wait:.1f} seconds...")
+            await asyncio.sleep(wait)
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            break
+
+    return None
+
+
+async def _insight_async(build_messages, insight_type, fallback, ticker):
+    result = await ask_openai_async(build_messages(ticker),
+                                    cache_key=_insight_cache_key(insight_type, ticker))
+    return fallback if result is None else result
+
+
+async def analyze_ticker(ticker, semaphore=None):
+    """Fetch all four insights for one ticker concurrently.
+
+    Pass a shared asyncio.Semaphore to cap total in-flight requests when
+    fanning out over many tickers.
+    """
+    async def run():
+        sentiment, earnings, stock, value = await asyncio.gather(
+            _insight_async(_sentiment_messages, 'sentiment', "No sentiment analysis available", ticker),
+            _insight_async(_earnings_messages, 'earnings', "No earnings call analysis available", ticker),
+            _insight_async(_stock_messages, 'stock', "No stock insights available", ticker),
+            _insight_async(_value_messages, 'value', "No value investing analysis available", ticker),
+        )
+        return {
+            'sentiment_insight': sentiment,
+            'earnings_insight': earnings,
+            'stock_insight': stock,
+            'value_insight': value,
+        }
+
+    if semaphore is None:
+        return await run()
+    async with semaphore:
+        return await run()
+
+
 # === OpenAI Analyses ===
-def sentiment_analysis(ticker):
+# Message builders are shared between the single-ticker and batch paths so
+# both produce the same per-ticker cache keys
+
+# Every request starts with this identical prefix so the provider's prompt
+# caching can reuse it across tickers and insight types; only the role
+# specialization at the end varies
+BASE_SYSTEM = (
+    "You are a senior financial analyst looking for stocks that are undervalued "
+    "and have a good chance of growth. Ground every answer in concrete, "
+    "decision-relevant factors, be concise and to the point, and never pad "
+    "answers with disclaimers or generic advice."
+)
+
+# System messages are immutable, so build each dict once instead of
+# re-concatenating the prefix on every call
+_SENTIMENT_SYS = {"role": "system", "content": BASE_SYSTEM + "\n\nROLE: market sentiment analyst. Focus on key factors like news, earnings, and market sentiment."}
+_EARNINGS_SYS = {"role": "system", "content": BASE_SYSTEM + "\n\nROLE: earnings-call analyst. Provide key insights from the earnings call."}
+_STOCK_SYS = {"role": "system", "content": BASE_SYSTEM + "\n\nROLE: equity analyst. Provide a summary of key investment insights."}
+_VALUE_SYS = {"role": "system", "content": BASE_SYSTEM + "\n\nROLE: value investor. Compare key financial metrics with the industry and provide an investment recommendation."}
+_COMBINED_SYS = {"role": "system", "content": BASE_SYSTEM + "\n\nROLE: multi-role analyst. Answer each requested key in its specialist's voice."}
+
+
+def _sentiment_messages(ticker):
     prompt = f"Provide a sentiment analysis for stock {ticker} based on recent news and social media posts. Is the sentiment positive, negative, or neutral? Focus on key drivers (e.g., earnings reports, news events, market sentiment) Be concise and to the point, maximum 2 sentences."
-    result = ask_openai([
-        {"role": "system", "content": "You are a market sentiment analyst who is looking for stocks that are undervalued and have a good chance of growth. Focus on key factors like news, earnings, and market sentiment."},
+    return [
+        _SENTIMENT_SYS,
         {"role": "user", "content": prompt}
-    ])
-    if result is None:
-        return "No sentiment analysis available"
-    return result
+    ]
 
 
-# Analyse earnings calls for the stock using OpenAI
-def earnings_call(ticker):
+def _earnings_messages(ticker):
     prompt = f"Summarize the latest earnings call for stock {ticker}. Highlight key points such as management outlook, risks, opportunities, and financial performance. Be concise and to the point, maximum 2 sentences."
-    result = ask_openai([
-        {"role": "system", "content": "You are a financial analyst who is looking for stocks that are undervalued and have a good chance of growth. Provide key insights from the earnings call."},
+    return [
+        _EARNINGS_SYS,
         {"role": "user", "content": prompt}
-    ])
-    if result is None:
-        return "No earnings call analysis available"
-    return result
+    ]
 
 
-# Stock analysis using OpenAI
-def stock_insights(ticker):
+def _stock_messages(ticker):
     prompt = f"Analyze stock {ticker}. Include its business model, growth prospects, financial performance, and risks. Provide key investment takeaways. Be concise and to the point, maximum 2 sentences."
-    result = ask_openai([
-        {"role": "system", "content": "You are a financial analyst who is looking for stocks that are undervalued and have a good chance of growth. Provide a summary of key investment insights."},
+    return [
+        _STOCK_SYS,
         {"role": "user", "content": prompt}
-    ])
-    if result is None:
-        return "No stock insights available"
-    return result
+    ]
 
 
-# Value investing analysis using OpenAI
-def value_investing(ticker):
+def _value_messages(ticker):
     prompt = f"Evaluate stock {ticker} from a value investor's perspective. Compare key metrics (PE ratio, PB ratio, ROE) to the industry average and provide investment recommendations. Be concise and to the point, maximum 2 sentences."
-    result = ask_openai([
-        {"role": "system", "content": "You are a value investor who is looking for stocks that are undervalued and have a good chance of growth. Compare key financial metrics with the industry and provide an investment recommendation."},
+    return [
+        _VALUE_SYS,
         {"role": "user", "content": prompt}
-    ])
-    if result is None:
-        return "No value investing analysis available"
-    return result
\ No newline at end of file
+    ]
+
+
+def _insight(build_messages, insight_type, fallback, ticker):
+    """Return a cached insight, building the prompt only on a miss."""
+    cache_key = _insight_cache_key(insight_type, ticker)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        print("Cache hit 🔥")
+        return cached
+    result = ask_openai(build_messages(ticker), cache_key=cache_key)
+    return fallback if result is None else result
+
+
+def sentiment_analysis(ticker):
+    return _insight(_sentiment_messages, 'sentiment',
+                    "No sentiment analysis available", ticker)
+
+
+# Analyse earnings calls for the stock using OpenAI
+def earnings_call(ticker):
+    return _insight(_earnings_messages, 'earnings',
+                    "No earnings call analysis available", ticker)
+
+
+# Stock analysis using OpenAI
+def stock_insights(ticker):
+    return _insight(_stock_messages, 'stock',
+                    "No stock insights available", ticker)
+
+
+# Value investing analysis using OpenAI
+def value_investing(ticker):
+    return _insight(_value_messages, 'value',
+                    "No value investing analysis available", ticker)
+
+
+# === Combined single-ticker analysis ===
+# One completion covering all four insight types — a quarter of the round
+# trips and system-prompt tokens of asking them separately
+
+_COMBINED_FALLBACKS = {
+    'sentiment': "No sentiment analysis available",
+    'earnings': "No earnings call analysis available",
+    'stock': "No stock insights available",
+    'value': "No value investing analysis available",
+}
+
+
+def combined_insights(ticker):
+    """Fetch all four insights for one ticker with a single completion.
+
+    Returns the same column-keyed dict the batch path produces; each
+    insight is cached under its own per-type key so the batch and single
+    paths share cache entries.
+    """
+    cached = {t: _cache_get(_insight_cache_key(t, ticker))
+              for t in _COMBINED_FALLBACKS}
+
+    results = dict(cached)
+    if any(v is None for v in cached.values()):
+        prompt = (
+            f"Analyze stock {ticker} and respond with strict JSON containing exactly "
+            "the keys sentiment, earnings, stock, and value. "
+            "sentiment: sentiment analysis based on recent news and social media posts — "
+            "positive, negative, or neutral, with key drivers. "
+            "earnings: summary of the latest earnings call — management outlook, risks, "
+            "opportunities, and financial performance. "
+            "stock: analysis of the business model, growth prospects, financial "
+            "performance, and risks, with key investment takeaways. "
+            "value: evaluation from a value investor's perspective comparing PE ratio, "
+            "PB ratio, and ROE to the industry average, with a recommendation. "
+            "Be concise and to the point, maximum 2 sentences per key."
+        )
+        content = ask_openai(
+            [
+                _COMBINED_SYS,
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=700,
+            response_format={"type": "json_object"}
+        )
+        parsed = {}
+        if content is not None:
+            try:
+                parsed = json.loads(content)
+            except json.JSONDecodeError as e:
+                print(f"Could not parse combined response: {e}")
+        for insight_type in _COMBINED_FALLBACKS:
+            if results[insight_type] is None:
+                answer = parsed.get(insight_type)
+                if answer:
+                    results[insight_type] = answer
+                    _cache_put(_insight_cache_key(insight_type, ticker), answer)
+
+    return {
+        f"{insight_type}_insight": results[insight_type] or fallback
+        for insight_type, fallback in _COMBINED_FALLBACKS.items()
+    }
+
+
+# === Batched analyses ===
+# One chat completion covering N tickers instead of N completions — request
+# overhead amortizes across the batch and the result comes back as one JSON map
+
+def _batch_insight(tickers, build_messages, insight_type, task, fallback):
+    results = {}
+    cache_keys = {}
+    misses = []
+    for ticker in tickers:
+        key = _insight_cache_key(insight_type, ticker)
+        cache_keys[ticker] = key
+        cached = _cache_get(key)
+        if cached is not None:
+            print(f"Cache hit 🔥 for {ticker}")
+            results[ticker] = cached
+        else:
+            misses.append(ticker)
+
+    if misses:
+        system_content = build_messages(misses[0])[0]["content"]
+        prompt = (
+            f"For each of the following stock tickers, {task} "
+            "Be concise and to the point, maximum 2 sentences per ticker. "
+            "Respond with strict JSON mapping each ticker symbol to its answer. "
+            f"Tickers: {', '.join(misses)}"
+        )
+        content = ask_openai(
+            [
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=150 * len(misses) + 100,
+            response_format={"type": "json_object"}
+        )
+        parsed = {}
+        if content is not None:
+            try:
+                parsed = {k.upper(): v for k, v in json.loads(content).items()}
+            except (json.JSONDecodeError, AttributeError) as e:
+                print(f"Could not parse batch response: {e}")
+        for ticker in misses:
+            answer = parsed.get(ticker.upper())
+            if answer:
+                results[ticker] = answer
+                _cache_put(cache_keys[ticker], answer)
+            else:
+                results[ticker] = fallback
+
+    return results
+
+
+def sentiment_analysis_batch(tickers):
+    return _batch_insight(
+        tickers, _sentiment_messages, 'sentiment',
+        "provide a sentiment analysis based on recent news and social media posts — is the sentiment positive, negative, or neutral, and what are the key drivers?",
+        "No sentiment analysis available"
+    )
+
+
+def earnings_call_batch(tickers):
+    return _batch_insight(
+        tickers, _earnings_messages, 'earnings',
+        "summarize the latest earnings call, highlighting management outlook, risks, opportunities, and financial performance.",
+        "No earnings call analysis available"
+    )
+
+
+def stock_insights_batch(tickers):
+    return _batch_insight(
+        tickers, _stock_messages, 'stock',
+        "analyze the stock's business model, growth prospects, financial performance, and risks, with key investment takeaways.",
+        "No stock insights available"
+    )
+
+
+def value_investing_batch(tickers):
+    return _batch_insight(
+        tickers, _value_messages, 'value',
+        "evaluate the stock from a value investor's perspective, comparing PE ratio, PB ratio, and ROE to the industry average with a recommendation.",
+        "No value investing analysis available"
+    )
\ No newline at end of file
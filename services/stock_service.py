@@ -1,33 +1,51 @@
+import atexit
 import os
 import json
 import time
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from datetime import datetime, timedelta
-import random
+import httpx
+import functools
+from collections import Counter, deque
 from typing import Dict, Any, Optional, List, Set
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from queue import Queue
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import queue
 import threading
 from tqdm import tqdm
 
+from config import THRESHOLDS
+from analysis.financial_analysis import meets_value_criteria
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json when orjson isn't installed
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # typed decoding is an optional speed-up, not a requirement
+    msgspec = None
+
+# JSON shims: orjson parses/serializes several times faster than stdlib and
+# works in bytes directly, which matters for large statement responses
+if orjson is not None:
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    _loads = orjson.loads
+else:
+    def _dumps(obj):
+        return json.dumps(obj, sort_keys=True).encode()
+    _loads = json.loads
+
 # Configuration
-REQUEST_DELAY        = 2.0
 MAX_RETRIES          = 3
 BACKOFF_FACTOR       = 2
 RATE_LIMIT_DELAY     = 60
 BATCH_SIZE           = 5
 CACHE_DIR            = "cache"
 CACHE_FILE           = os.path.join(CACHE_DIR, "stock_data_cache.json")
+CACHE_JOURNAL        = os.path.join(CACHE_DIR, "stock_data_cache.jsonl")
 CACHE_EXPIRY         = 24 * 60 * 60
 MAX_WORKERS          = 3  # Number of parallel workers
-MAX_QUEUE_SIZE       = 1000  # Maximum size of the retry queue
-last_request_time    = 0
-rate_limit_hit       = False
-request_count        = 0
-window_start         = time.time()
 WINDOW_SIZE          = 60
 MAX_REQUESTS_PER_WINDOW = 30
 
@@ -35,48 +53,168 @@ MAX_REQUESTS_PER_WINDOW = 30
 FMP_API_KEY = os.getenv("FMP_API_KEY")
 FMP_BASE    = "https://financialmodelingprep.com/api/v3"
 
+# In memory the cache is keyed on (endpoint, sorted params tuple) — hashing
+# a small tuple is far cheaper than serializing params to JSON per lookup.
+# JSON object keys must be strings, so convert only at the load/save boundary.
+def _key_to_str(key):
+    if isinstance(key, str):  # tolerate legacy string keys
+        return key
+    endpoint, params_items = key
+    return f"{endpoint}|{_dumps(dict(params_items)).decode()}"
+
+def _key_from_str(key_str):
+    endpoint, sep, params_json = key_str.partition('|')
+    if not sep:
+        return key_str
+    return (endpoint, tuple(sorted(_loads(params_json).items())))
+
 def ensure_cache_dir():
     if not os.path.exists(CACHE_DIR):
         os.makedirs(CACHE_DIR)
 
+# Precompiled typed decoders: the cache file and journal have a known shape,
+# and msgspec decodes a known schema faster than generic JSON parsing
+if msgspec is not None:
+    _cache_decoder = msgspec.json.Decoder(Dict[str, Dict[str, Any]])
+    _journal_decoder = msgspec.json.Decoder(Dict[str, Any])
+
 def load_cache():
     ensure_cache_dir()
+    data = {}
     if os.path.exists(CACHE_FILE):
         try:
-            with open(CACHE_FILE, 'r') as f:
-                data = json.load(f)
-                now = time.time()
-                return {k: v for k, v in data.items()
-                        if now - v.get('timestamp', 0) < CACHE_EXPIRY}
+            with open(CACHE_FILE, 'rb') as f:
+                raw = f.read()
+            if raw:
+                decoded = _cache_decoder.decode(raw) if msgspec else _loads(raw)
+                data = {_key_from_str(k): v for k, v in decoded.items()}
         except Exception as e:
             logging.error(f"Error loading cache: {e}")
-    return {}
+    # Merge the append-only journal on top (last write wins)
+    if os.path.exists(CACHE_JOURNAL):
+        try:
+            with open(CACHE_JOURNAL, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        record = _journal_decoder.decode(line) if msgspec else _loads(line)
+                        data[_key_from_str(record['key'])] = record['entry']
+        except Exception as e:
+            logging.error(f"Error loading cache journal: {e}")
+    # Prune expired entries in place — rebuilding the dict costs a full
+    # copy of every live entry at startup
+    now = time.time()
+    for k in list(data):
+        if now - data[k].get('timestamp', 0) >= CACHE_EXPIRY:
+            del data[k]
+    return data
 
 def save_cache(cache_data):
     ensure_cache_dir()
     try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache_data, f)
+        with open(CACHE_FILE, 'wb') as f:
+            f.write(_dumps({_key_to_str(k): v for k, v in cache_data.items()}))
     except Exception as e:
         logging.error(f"Error saving cache: {e}")
 
+# Journal appends happen on a single daemon thread so disk latency hides
+# behind network latency instead of blocking the next request dispatch
+_cache_q = queue.SimpleQueue()
+_cache_writer_thread = None
+_cache_writer_lock = threading.Lock()
+
+def _cache_writer():
+    while True:
+        # Block for one record, then drain whatever else queued up so a
+        # burst of fetches becomes one append syscall
+        records = [_cache_q.get()]
+        try:
+            while True:
+                records.append(_cache_q.get_nowait())
+        except queue.Empty:
+            pass
+        ensure_cache_dir()
+        try:
+            with open(CACHE_JOURNAL, 'ab') as f:
+                for key, entry in records:
+                    f.write(_dumps({'key': _key_to_str(key), 'entry': entry}) + b'\n')
+        except Exception as e:
+            logging.error(f"Error appending cache entries: {e}")
+
+def append_cache_entry(key, entry):
+    """Queue one new cache entry for the journal — O(entry), not O(cache)."""
+    global _cache_writer_thread
+    if _cache_writer_thread is None:
+        with _cache_writer_lock:
+            if _cache_writer_thread is None:
+                _cache_writer_thread = threading.Thread(target=_cache_writer, daemon=True)
+                _cache_writer_thread.start()
+    _cache_q.put((key, entry))
+
+def compact_cache():
+    """Fold the journal into the canonical cache file once, at shutdown.
+
+    Every queued entry is already in stock_cache, so the full save below
+    covers anything the writer thread hasn't flushed yet.
+    """
+    save_cache(stock_cache)
+    save_invalid_tickers()
+    if os.path.exists(CACHE_JOURNAL):
+        try:
+            os.remove(CACHE_JOURNAL)
+        except OSError as e:
+            logging.error(f"Error removing cache journal: {e}")
+
+# Tickers that FMP has no usable data for (delisted, non-equity, bad
+# symbols). Remembering them across runs saves a full endpoint fan-out per
+# bad symbol per run; the file TTL lets re-listed symbols retry eventually.
+INVALID_TICKERS_FILE = os.path.join(CACHE_DIR, "invalid_tickers.json")
+INVALID_TICKERS_TTL = 30 * 24 * 60 * 60
+
+def _load_invalid_tickers() -> Set[str]:
+    try:
+        if os.path.exists(INVALID_TICKERS_FILE):
+            if time.time() - os.path.getmtime(INVALID_TICKERS_FILE) < INVALID_TICKERS_TTL:
+                with open(INVALID_TICKERS_FILE, 'rb') as f:
+                    return set(_loads(f.read()))
+            os.remove(INVALID_TICKERS_FILE)
+    except Exception as e:
+        logging.error(f"Error loading invalid-ticker set: {e}")
+    return set()
+
+def save_invalid_tickers():
+    ensure_cache_dir()
+    try:
+        with open(INVALID_TICKERS_FILE, 'wb') as f:
+            f.write(_dumps(sorted(_invalid_tickers)))
+    except Exception as e:
+        logging.error(f"Error saving invalid-ticker set: {e}")
+
+def mark_invalid_ticker(ticker: str):
+    _invalid_tickers.add(ticker)
+    # Persist periodically so a crash doesn't lose a long run's rejections
+    if len(_invalid_tickers) % 32 == 0:
+        save_invalid_tickers()
+
+_invalid_tickers = _load_invalid_tickers()
+
 # Initialize cache
 stock_cache = load_cache()
 
-def create_session():
-    session = requests.Session()
-    retry = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=BACKOFF_FACTOR,
-        status_forcelist=[429,500,502,503,504],
-        respect_retry_after_header=True
+atexit.register(compact_cache)
+
+def create_client():
+    # HTTP/2 multiplexes the eight per-ticker endpoint requests over one
+    # TLS connection instead of one HTTP/1.1 stream each; connect-level
+    # retries live in the transport, status handling stays in _fmp_get_impl
+    return httpx.Client(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=MAX_WORKERS,
+                            max_keepalive_connections=MAX_WORKERS),
+        transport=httpx.HTTPTransport(retries=MAX_RETRIES),
     )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=1)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
 
-session = create_session()
+client = create_client()
 
 def validate_api_key() -> bool:
     """Validate FMP API key by making a test request."""
@@ -87,7 +225,8 @@ def validate_api_key() -> bool:
         # Test the API key with a simple request
         test_url = f"{FMP_BASE}/profile/AAPL"
         params = {"apikey": FMP_API_KEY}
-        response = requests.get(test_url, params=params)
+        # Use the shared client so validation also warms the connection pool
+        response = client.get(test_url, params=params)
         
         if response.status_code == 401:
             raise ValueError("Invalid FMP API key")
@@ -102,149 +241,147 @@ def validate_api_key() -> bool:
         logging.error(f"Error validating FMP API key: {e}")
         return False
 
+# Response shape requirements per base endpoint: mode "all" means every
+# field must be present, "any" means at least one must be. Endpoints not
+# listed here (e.g. historical-price-full) have no shape requirements.
+_SCHEMA = {
+    "profile": ("all", ("symbol", "price", "mktCap")),
+    "balance-sheet-statement": ("any", ()),
+    "income-statement": ("any", ()),
+    "cash-flow-statement": ("any", ()),
+    "key-metrics-ttm": ("any", ("peRatio", "pbRatio", "roe")),
+    "ratios-ttm": ("any", ("priceEarningsRatio", "priceToBookRatio", "returnOnEquity")),
+    "market-sentiment": ("any", ("rating", "targetPrice", "recommendation")),
+    "financial-growth-ttm": ("any", ("revenueGrowth", "netIncomeGrowth", "epsgrowth")),
+    "enterprise-values": ("any", ("enterpriseValue", "enterpriseValueMultiple")),
+}
+
+# Pre-frozen at import time so the field checks run as C-level set algebra
+# instead of an interpreted generator per call
+_REQUIRED_ANY = {ep: frozenset(fields) for ep, (mode, fields) in _SCHEMA.items()
+                 if mode == "any" and fields}
+_REQUIRED_ALL = {ep: frozenset(fields) for ep, (mode, fields) in _SCHEMA.items()
+                 if mode == "all" and fields}
+
 def validate_response_data(data: Any, endpoint: str) -> bool:
     """Validate the structure and content of FMP API responses."""
     if not data:
-        logging.warning(f"Empty response from {endpoint}")
+        logging.warning("Empty response from %s", endpoint)
         return False
-    
-    # Extract the base endpoint name
-    base_endpoint = endpoint.split('/')[0]
-    
-    if base_endpoint == "profile":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid profile data structure: {data}")
-            return False
-        required_fields = ["symbol", "price", "mktCap"]
-        if not all(field in data[0] for field in required_fields):
-            logging.warning(f"Missing required fields in profile data: {data[0]}")
-            return False
-    
-    elif base_endpoint in ["balance-sheet-statement", "income-statement", "cash-flow-statement"]:
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid {base_endpoint} data structure: {data}")
-            return False
-            
-    elif base_endpoint == "key-metrics-ttm":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid key metrics TTM data structure: {data}")
-            return False
-        required_fields = ["peRatio", "pbRatio", "roe"]
-        if not any(field in data[0] for field in required_fields):
-            logging.warning(f"Missing all key metrics fields: {data[0]}")
-            return False
-            
-    elif base_endpoint == "ratios-ttm":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid ratios TTM data structure: {data}")
-            return False
-        required_fields = ["priceEarningsRatio", "priceToBookRatio", "returnOnEquity"]
-        if not any(field in data[0] for field in required_fields):
-            logging.warning(f"Missing all ratio fields: {data[0]}")
-            return False
-            
-    elif base_endpoint == "market-sentiment":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid market sentiment data structure: {data}")
-            return False
-        required_fields = ["rating", "targetPrice", "recommendation"]
-        if not any(field in data[0] for field in required_fields):
-            logging.warning(f"Missing all sentiment fields: {data[0]}")
-            return False
-            
-    elif base_endpoint == "financial-growth-ttm":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid financial growth TTM data structure: {data}")
-            return False
-        required_fields = ["revenueGrowth", "netIncomeGrowth", "epsgrowth"]
-        if not any(field in data[0] for field in required_fields):
-            logging.warning(f"Missing all growth fields: {data[0]}")
-            return False
-            
-    elif base_endpoint == "enterprise-values":
-        if not isinstance(data, list) or len(data) == 0:
-            logging.warning(f"Invalid enterprise values data structure: {data}")
-            return False
-        required_fields = ["enterpriseValue", "enterpriseValueMultiple"]
-        if not any(field in data[0] for field in required_fields):
-            logging.warning(f"Missing all enterprise value fields: {data[0]}")
-            return False
-    
+
+    # One dict lookup replaces the old chain of string compares
+    base_endpoint = endpoint.partition('/')[0]
+    if base_endpoint not in _SCHEMA:
+        return True
+
+    if not isinstance(data, list) or len(data) == 0:
+        logging.warning("Invalid %s data structure: %s", endpoint, data)
+        return False
+
+    required_all = _REQUIRED_ALL.get(base_endpoint)
+    if required_all is not None and not required_all <= data[0].keys():
+        logging.warning("Missing required fields for %s: %s", endpoint, data[0])
+        return False
+
+    required_any = _REQUIRED_ANY.get(base_endpoint)
+    if required_any is not None and required_any.isdisjoint(data[0]):
+        logging.warning("Missing required fields for %s: %s", endpoint, data[0])
+        return False
+
     return True
 
-def handle_rate_limit():
-    global rate_limit_hit, last_request_time, request_count, window_start
-    now = time.time()
-    if now - window_start >= WINDOW_SIZE:
-        window_start = now
-        request_count = 0
-        logging.info("Rate limit window reset")
-    if request_count >= MAX_REQUESTS_PER_WINDOW:
-        sleep = WINDOW_SIZE - (now - window_start)
-        if sleep > 0:
-            logging.warning(f"Rate limit reached, sleeping {sleep:.2f} seconds")
-            time.sleep(sleep)
-            window_start = time.time()
-            request_count = 0
-            logging.info("Cooldown complete")
-    jitter = random.uniform(0, 1)
-    sleep = REQUEST_DELAY + jitter
-    logging.info(f"Waiting {sleep:.2f} seconds before next request")
-    time.sleep(sleep)
-    last_request_time = now
-    request_count += 1
-    logging.info(f"Request count in current window: {request_count}/{MAX_REQUESTS_PER_WINDOW}")
+class _FetchFailure(Exception):
+    """Internal: raised so the LRU layer doesn't memoize failed fetches."""
 
 def _fmp_get(endpoint: str, params: dict = None) -> Optional[Dict]:
     """Helper to GET and cache FMP JSON data with improved error handling."""
-    if params is None:
-        params = {}
+    params_items = tuple(sorted((params or {}).items()))
+    try:
+        return _fmp_get_cached(endpoint, params_items)
+    except _FetchFailure:
+        return None
+
+@functools.lru_cache(maxsize=4096)
+def _fmp_get_cached(endpoint: str, params_items: tuple) -> Dict:
+    # In-memory memoization in front of the disk cache: repeated keys in one
+    # run skip the cache-key serialization and dict round-trip entirely.
+    # Failures raise instead of returning None so they aren't remembered.
+    data = _fmp_get_impl(endpoint, dict(params_items))
+    if data is None:
+        raise _FetchFailure(endpoint)
+    return data
+
+def _fmp_get_impl(endpoint: str, params: dict) -> Optional[Dict]:
+    # Key the cache on the request minus the apikey: a tuple key hashes in
+    # one C call, and rotating the API key doesn't invalidate any entry
+    key = (endpoint, tuple(sorted(params.items())))
     params["apikey"] = FMP_API_KEY
-    
-    # Check cache
-    key = f"{endpoint}|{json.dumps(params, sort_keys=True)}"
     if key in stock_cache:
         cache_entry = stock_cache[key]
         if time.time() - cache_entry['timestamp'] < CACHE_EXPIRY:
             return cache_entry['data']
     
     try:
-        handle_rate_limit()
+        # The thread-safe RateLimiter is the single source of rate shaping;
+        # it only sleeps when the window is actually exhausted
+        rate_limiter.wait_if_needed()
         url = f"{FMP_BASE}/{endpoint}"
-        response = session.get(url, params=params)
+        response = client.get(url, params=params)
         
         # Handle specific FMP error codes
         if response.status_code == 401:
             raise ValueError("Invalid FMP API key")
         elif response.status_code == 429:
-            logging.warning("FMP API rate limit reached")
-            time.sleep(RATE_LIMIT_DELAY)
+            # Honor the server's Retry-After instead of a fixed worst-case
+            # sleep; fall back to RATE_LIMIT_DELAY when the header is absent
+            try:
+                wait = float(response.headers.get("Retry-After", RATE_LIMIT_DELAY))
+            except ValueError:
+                wait = RATE_LIMIT_DELAY
+            logging.warning("FMP API rate limit reached, waiting %.0fs", wait)
+            time.sleep(wait)
             return None
         elif response.status_code == 404:
-            logging.warning(f"Endpoint not found: {endpoint}")
-            return None
+            # Definitive: the symbol has no data at this endpoint. Return an
+            # empty list rather than None so callers can tell "no such data"
+            # apart from a transient failure worth retrying
+            logging.warning("Endpoint not found: %s", endpoint)
+            return []
         elif response.status_code != 200:
-            raise requests.exceptions.HTTPError(f"HTTP {response.status_code}: {response.text}")
-        
-        data = response.json()
+            raise httpx.HTTPStatusError(
+                f"HTTP {response.status_code}: {response.text}",
+                request=response.request, response=response)
         
-        # Log response for debugging
-        logging.debug(f"Response from {endpoint}: {json.dumps(data, indent=2)}")
+        data = _loads(response.content)
+
+        # Log response for debugging — serializing the full body is expensive
+        # (megabytes for price-history endpoints), so only do it when a DEBUG
+        # handler will actually see it
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Response from %s: %s", endpoint, json.dumps(data, indent=2))
         
+        # A well-formed empty body is likewise a definitive "no data for
+        # this symbol", not a failure
+        if data == [] or data == {}:
+            logging.warning("Empty response from %s", endpoint)
+            return []
+
         # Validate response data
         if not validate_response_data(data, endpoint):
             return None
         
-        # Cache the result
-        stock_cache[key] = {
+        # Cache the result — append just this entry to the journal instead
+        # of rewriting the whole cache file on every fetch
+        entry = {
             'data': data,
             'timestamp': time.time()
         }
-        save_cache(stock_cache)
-        
+        stock_cache[key] = entry
+        append_cache_entry(key, entry)
+
         return data
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Request error for {endpoint}: {e}")
         return None
     except json.JSONDecodeError as e:
@@ -254,99 +391,222 @@ def _fmp_get(endpoint: str, params: dict = None) -> Optional[Dict]:
         logging.error(f"Unexpected error for {endpoint}: {e}")
         return None
 
-def fetch_stock_data(ticker: str) -> Dict[str, Any]:
+# Shared pool for the per-ticker endpoint fan-out — created once so thread
+# setup cost isn't paid per ticker
+_endpoint_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fmp-endpoint")
+
+# Declarative (output_field, api_field) maps, one per source endpoint. A
+# single loop per source replaces ~60 hand-written .get lines, so the
+# extraction is one tight iteration instead of a bytecode sequence per field.
+_KM_FIELDS = (
+    ('pe_ratio', 'peRatioTTM'),
+    ('forward_pe', 'forwardPE'),
+    ('price_to_book_ratio', 'pbRatioTTM'),
+    ('price_to_sales', 'priceToSalesRatioTTM'),
+    ('market_cap', 'marketCapTTM'),
+    ('ev_ebitda', 'enterpriseValueOverEBITDATTM'),
+    ('ebitda_margin', 'ebitdaMarginTTM'),
+    ('fcf_yield', 'freeCashFlowYieldTTM'),
+    ('beta', 'beta'),
+)
+
+_RATIO_FIELDS = (
+    ('roe_ratio', 'returnOnEquityTTM'),
+    ('roa', 'returnOnAssetsTTM'),
+    ('net_margin', 'netProfitMarginTTM'),
+    ('operating_margin', 'operatingProfitMarginTTM'),
+    ('gross_margin', 'grossProfitMarginTTM'),
+    ('de_ratio', 'debtEquityRatioTTM'),
+    ('current_ratio', 'currentRatioTTM'),
+    ('quick_ratio', 'quickRatioTTM'),
+    ('interest_coverage', 'interestCoverageTTM'),
+    ('dividend_yield', 'dividendYielTTM'),
+    ('payout_ratio', 'payoutRatioTTM'),
+)
+
+_BS_FIELDS = (
+    ('total_debt', 'totalDebt'),
+    ('total_cash', 'cashAndCashEquivalents'),
+    ('total_equity', 'totalStockholdersEquity'),
+)
+
+_CF_FIELDS = (
+    ('free_cash_flow', 'freeCashFlow'),
+    ('operating_cash_flow', 'operatingCashFlow'),
+)
+
+_GROWTH_FIELDS = (
+    ('revenue_growth_ttm', 'revenueGrowth'),
+    ('net_income_growth_ttm', 'netIncomeGrowth'),
+    ('eps_growth_ttm', 'epsGrowth'),
+    ('fcf_growth_ttm', 'freeCashFlowGrowth'),
+    ('dividend_growth_ttm', 'dividendGrowth'),
+    ('book_value_growth_ttm', 'bookValueGrowth'),
+    ('roe_growth_ttm', 'roeGrowth'),
+    ('roa_growth_ttm', 'roaGrowth'),
+)
+
+_SENT_FIELDS = (
+    ('analyst_rating', 'rating'),
+    ('price_target', 'targetPrice'),
+    ('price_target_high', 'targetHighPrice'),
+    ('price_target_low', 'targetLowPrice'),
+    ('price_target_mean', 'targetMeanPrice'),
+    ('price_target_median', 'targetMedianPrice'),
+    ('analyst_recommendation', 'recommendation'),
+    ('rating_score', 'ratingScore'),
+    ('insider_ownership', 'insiderOwnership'),
+    ('institutional_ownership', 'institutionalOwnership'),
+    ('short_ratio', 'shortRatio'),
+    ('rsi', 'rsi'),
+)
+
+
+# Every key a fully assembled record carries, in output order. The CSV
+# writer derives its header from this, so a new field-map entry shows up
+# in the output without touching the analysis code.
+RECORD_COLUMNS = ('symbol',) + tuple(
+    key
+    for fields in (_KM_FIELDS, _RATIO_FIELDS, _BS_FIELDS, _CF_FIELDS,
+                   _GROWTH_FIELDS, _SENT_FIELDS)
+    for key, _ in fields
+)
+
+
+def _extract(dst: Dict, src_list: Optional[List], fields: tuple) -> None:
+    """Copy mapped fields from the first record of src_list into dst."""
+    src = src_list[0] if src_list else {}
+    for key, src_key in fields:
+        dst[key] = src.get(src_key)
+
+
+# Coalesce concurrent fetches of the same ticker: only the first caller
+# goes upstream, everyone else waits on its Future
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+def fetch_stock_data(ticker: str, include_raw: bool = False) -> Dict[str, Any]:
     """
     Fetch comprehensive stock data from FMP API.
     
     Args:
         ticker: Stock ticker symbol
+        include_raw: Attach the raw endpoint responses under 'raw_data'.
+            Off by default — the blob dominates per-ticker memory and
+            nothing downstream reads it.
         
     Returns:
         Dictionary containing stock data and metrics
     """
+    if ticker in _invalid_tickers:
+        logging.debug("Skipping known-invalid ticker %s", ticker)
+        return None
+    if include_raw:
+        # Rare debugging path; skip the coalescing map and record cache
+        return _fetch_stock_data(ticker, include_raw=True)
+    with _inflight_lock:
+        fut = _inflight.get(ticker)
+        owner = fut is None
+        if owner:
+            fut = _inflight[ticker] = Future()
+    if not owner:
+        return fut.result()
     try:
-        # Fetch data from various endpoints
-        profile_data = _fmp_get(f"profile/{ticker}")
-        balance_sheet = _fmp_get(f"balance-sheet-statement/{ticker}")
-        income_stmt = _fmp_get(f"income-statement/{ticker}")
-        cash_flow = _fmp_get(f"cash-flow-statement/{ticker}")
-        key_metrics = _fmp_get(f"key-metrics-ttm/{ticker}")
-        ratios = _fmp_get(f"ratios-ttm/{ticker}")
-        sentiment = _fmp_get(f"market-sentiment/{ticker}")
-        growth = _fmp_get(f"financial-growth-ttm/{ticker}")
-        
-        # Extract and map metrics
-        data = {
-            # Valuation Metrics
-            'pe_ratio': key_metrics[0].get('peRatioTTM'),
-            'forward_pe': key_metrics[0].get('forwardPE'),
-            'price_to_book': key_metrics[0].get('pbRatioTTM'),
-            'price_to_sales': key_metrics[0].get('priceToSalesRatioTTM'),
-            'market_cap': key_metrics[0].get('marketCapTTM'),
-            'ev_ebitda': key_metrics[0].get('enterpriseValueOverEBITDATTM'),
-            
-            # Profitability Metrics
-            'roe': ratios[0].get('returnOnEquityTTM'),
-            'roa': ratios[0].get('returnOnAssetsTTM'),
-            'net_margin': ratios[0].get('netProfitMarginTTM'),
-            'operating_margin': ratios[0].get('operatingProfitMarginTTM'),
-            'gross_margin': ratios[0].get('grossProfitMarginTTM'),
-            'ebitda_margin': key_metrics[0].get('ebitdaMarginTTM'),
-            
-            # Financial Health
-            'debt_to_equity': ratios[0].get('debtEquityRatioTTM'),
-            'total_debt': balance_sheet[0].get('totalDebt') if balance_sheet else None,
-            'total_cash': balance_sheet[0].get('cashAndCashEquivalents') if balance_sheet else None,
-            'total_equity': balance_sheet[0].get('totalStockholdersEquity') if balance_sheet else None,
-            'current_ratio': ratios[0].get('currentRatioTTM'),
-            'quick_ratio': ratios[0].get('quickRatioTTM'),
-            'interest_coverage': ratios[0].get('interestCoverageTTM'),
-            
-            # Cash Flow Metrics
-            'free_cash_flow': cash_flow[0].get('freeCashFlow') if cash_flow else None,
-            'operating_cash_flow': cash_flow[0].get('operatingCashFlow') if cash_flow else None,
-            'fcf_yield': key_metrics[0].get('freeCashFlowYieldTTM'),
-            'dividend_yield': ratios[0].get('dividendYielTTM'),
-            'payout_ratio': ratios[0].get('payoutRatioTTM'),
-            
-            # Growth Metrics
-            'revenue_growth_ttm': growth[0].get('revenueGrowth') if growth else None,
-            'net_income_growth_ttm': growth[0].get('netIncomeGrowth') if growth else None,
-            'eps_growth_ttm': growth[0].get('epsGrowth') if growth else None,
-            'fcf_growth_ttm': growth[0].get('freeCashFlowGrowth') if growth else None,
-            'dividend_growth_ttm': growth[0].get('dividendGrowth') if growth else None,
-            'book_value_growth_ttm': growth[0].get('bookValueGrowth') if growth else None,
-            'roe_growth_ttm': growth[0].get('roeGrowth') if growth else None,
-            'roa_growth_ttm': growth[0].get('roaGrowth') if growth else None,
-            
-            # Market Sentiment
-            'analyst_rating': sentiment[0].get('rating') if sentiment else None,
-            'price_target': sentiment[0].get('targetPrice') if sentiment else None,
-            'price_target_high': sentiment[0].get('targetHighPrice') if sentiment else None,
-            'price_target_low': sentiment[0].get('targetLowPrice') if sentiment else None,
-            'price_target_mean': sentiment[0].get('targetMeanPrice') if sentiment else None,
-            'price_target_median': sentiment[0].get('targetMedianPrice') if sentiment else None,
-            'analyst_recommendation': sentiment[0].get('recommendation') if sentiment else None,
-            'rating_score': sentiment[0].get('ratingScore') if sentiment else None,
-            'insider_ownership': sentiment[0].get('insiderOwnership') if sentiment else None,
-            'institutional_ownership': sentiment[0].get('institutionalOwnership') if sentiment else None,
-            'short_ratio': sentiment[0].get('shortRatio') if sentiment else None,
-            'rsi': sentiment[0].get('rsi') if sentiment else None,
-            'beta': key_metrics[0].get('beta'),
-            
-            # Raw data for reference
-            'raw_data': {
-                'profile': profile_data,
-                'balance_sheet': balance_sheet,
-                'income_statement': income_stmt,
-                'cash_flow': cash_flow,
-                'key_metrics': key_metrics,
-                'ratios': ratios,
-                'sentiment': sentiment,
-                'growth': growth
-            }
+        data = _fetch_stock_data(ticker)
+        fut.set_result(data)
+        return data
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(ticker, None)
+
+def _fetch_stock_data(ticker: str, include_raw: bool = False) -> Dict[str, Any]:
+    # Assembled records get their own TTL cache entry so a repeat query
+    # within the expiry window skips the eight endpoint lookups and the
+    # field extraction entirely
+    record_key = (f"stock_data/{ticker}", ())
+    if not include_raw:
+        cached = stock_cache.get(record_key)
+        if cached and time.time() - cached['timestamp'] < CACHE_EXPIRY:
+            return cached['data']
+
+    try:
+        # Phase 1: only the two endpoints carrying the four screening
+        # ratios. Most tickers fail the value screen, so the six remaining
+        # endpoints are fetched for survivors only.
+        screen_endpoints = {
+            'key_metrics': f"key-metrics-ttm/{ticker}",
+            'ratios': f"ratios-ttm/{ticker}",
         }
-        
+        futures = {name: _endpoint_executor.submit(_fmp_get, endpoint)
+                   for name, endpoint in screen_endpoints.items()}
+        responses = {name: future.result() for name, future in futures.items()}
+
+        # The screen can't run without metrics or ratios. Only a definitive
+        # answer (404 or a well-formed empty body, surfaced as []) marks the
+        # symbol invalid; a None from a transient failure — rate limit,
+        # timeout, bad JSON — falls through unmarked so the batch retry
+        # path gets another attempt
+        if not responses['key_metrics'] or not responses['ratios']:
+            logging.error(f"Error fetching data for {ticker}: missing key metrics or ratios")
+            if responses['key_metrics'] is not None and responses['ratios'] is not None:
+                mark_invalid_ticker(ticker)
+            return None
+
+        # Stamp the ticker onto the record first — the screen's debug log,
+        # the CSV writer, and the resume scan all key on it
+        data = {'symbol': ticker}
+        _extract(data, responses['key_metrics'], _KM_FIELDS)
+        _extract(data, responses['ratios'], _RATIO_FIELDS)
+
+        # Early exit for screen failures: the partial record carries the
+        # four ratios the caller re-checks, which is all a rejection needs.
+        # Left out of the record cache — both phase-1 responses are
+        # endpoint-cached, so re-screening stays cheap.
+        if not include_raw and not meets_value_criteria(data):
+            return data
+
+        # Phase 2: the remaining endpoints, survivors only
+        deep_endpoints = {
+            'profile': f"profile/{ticker}",
+            'balance_sheet': f"balance-sheet-statement/{ticker}",
+            'income': f"income-statement/{ticker}",
+            'cash_flow': f"cash-flow-statement/{ticker}",
+            'sentiment': f"market-sentiment/{ticker}",
+            'growth': f"financial-growth-ttm/{ticker}",
+        }
+        futures = {name: _endpoint_executor.submit(_fmp_get, endpoint)
+                   for name, endpoint in deep_endpoints.items()}
+        responses.update({name: future.result() for name, future in futures.items()})
+
+        _extract(data, responses['balance_sheet'], _BS_FIELDS)
+        _extract(data, responses['cash_flow'], _CF_FIELDS)
+        _extract(data, responses['growth'], _GROWTH_FIELDS)
+        _extract(data, responses['sentiment'], _SENT_FIELDS)
+
+        if include_raw:
+            # Raw endpoint responses, for debugging only — keeping these on
+            # every record multiplies resident memory across a full universe
+            data['raw_data'] = {
+                'profile': responses['profile'],
+                'balance_sheet': responses['balance_sheet'],
+                'income_statement': responses['income'],
+                'cash_flow': responses['cash_flow'],
+                'key_metrics': responses['key_metrics'],
+                'ratios': responses['ratios'],
+                'sentiment': responses['sentiment'],
+                'growth': responses['growth']
+            }
+        elif all(responses[name] is not None for name in deep_endpoints):
+            # Only complete records enter the 24h record cache — baking a
+            # transient phase-2 failure in would serve total_debt=None (and
+            # friends) for a day. Partial records still go to the caller.
+            entry = {'data': data, 'timestamp': time.time()}
+            stock_cache[record_key] = entry
+            append_cache_entry(record_key, entry)
+
         return data
         
     except Exception as e:
@@ -358,50 +618,67 @@ class RateLimiter:
     def __init__(self, max_requests: int, window_size: int):
         self.max_requests = max_requests
         self.window_size = window_size
-        self.requests = []
+        # deque gives O(1) expiry from the head with no reallocation, and
+        # this lock sits on the hot path of every request
+        self.requests = deque()
         self.lock = threading.Lock()
-    
+
     def wait_if_needed(self):
         with self.lock:
-            now = time.time()
+            # monotonic() is immune to wall-clock jumps mis-scheduling sleeps
+            now = time.monotonic()
             # Remove old requests
-            self.requests = [req_time for req_time in self.requests 
-                           if now - req_time < self.window_size]
-            
+            while self.requests and now - self.requests[0] >= self.window_size:
+                self.requests.popleft()
+
             if len(self.requests) >= self.max_requests:
                 sleep_time = self.window_size - (now - self.requests[0])
                 if sleep_time > 0:
                     time.sleep(sleep_time)
-                self.requests = self.requests[1:]
-            
-            self.requests.append(now)
+                self.requests.popleft()
+
+            self.requests.append(time.monotonic())
 
 # Initialize rate limiter
 rate_limiter = RateLimiter(MAX_REQUESTS_PER_WINDOW, WINDOW_SIZE)
 
 class BatchProcessor:
     def __init__(self):
-        self.retry_queue = Queue(maxsize=MAX_QUEUE_SIZE)
-        self.processed_tickers = set()
-        self.failed_tickers = set()
+        # Retries are drained sequentially between rounds, so a plain list
+        # under self.lock avoids queue.Queue's extra internal locking
+        self.retry_list: List[str] = []
+        # One status per ticker ("ok" | "failed") — a retried ticker that
+        # eventually succeeds flips to "ok" instead of being counted twice
+        self.state: Dict[str, str] = {}
         self.lock = threading.Lock()
         self.progress_bar = None
+        # One pool for the processor's lifetime — per-batch pools pay thread
+        # setup/teardown each round and lose warm per-thread connections
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fmp")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
     
     def process_ticker(self, ticker: str) -> Optional[Dict]:
         """Process a single ticker with rate limiting and error handling."""
         try:
-            rate_limiter.wait_if_needed()
             data = fetch_stock_data(ticker)
             
             with self.lock:
                 if data:
-                    self.processed_tickers.add(ticker)
+                    self.state[ticker] = "ok"
                     if self.progress_bar:
                         self.progress_bar.update(1)
                     return {ticker: data}
                 else:
-                    self.failed_tickers.add(ticker)
-                    self.retry_queue.put(ticker)
+                    self.state[ticker] = "failed"
+                    self.retry_list.append(ticker)
                     if self.progress_bar:
                         self.progress_bar.update(1)
                     return None
@@ -409,8 +686,8 @@ class BatchProcessor:
         except Exception as e:
             logging.error(f"Error processing {ticker}: {str(e)}")
             with self.lock:
-                self.failed_tickers.add(ticker)
-                self.retry_queue.put(ticker)
+                self.state[ticker] = "failed"
+                self.retry_list.append(ticker)
                 if self.progress_bar:
                     self.progress_bar.update(1)
             return None
@@ -424,22 +701,20 @@ class BatchProcessor:
         self.progress_bar = tqdm(total=len(tickers), desc="Processing stocks")
         
         while tickers and retry_count < max_retries:
-            # Process current batch
-            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                future_to_ticker = {
-                    executor.submit(self.process_ticker, ticker): ticker 
-                    for ticker in tickers
-                }
-                
-                for future in as_completed(future_to_ticker):
-                    result = future.result()
-                    if result:
-                        results.update(result)
+            # Process current batch on the shared pool
+            future_to_ticker = {
+                self.executor.submit(self.process_ticker, ticker): ticker
+                for ticker in tickers
+            }
+
+            for future in as_completed(future_to_ticker):
+                result = future.result()
+                if result:
+                    results.update(result)
             
             # Get failed tickers for retry
-            tickers = []
-            while not self.retry_queue.empty():
-                tickers.append(self.retry_queue.get())
+            with self.lock:
+                tickers, self.retry_list = self.retry_list, []
             
             if tickers:
                 retry_count += 1
@@ -451,38 +726,117 @@ class BatchProcessor:
 
     def get_statistics(self) -> Dict:
         """Get processing statistics."""
+        counts = Counter(self.state.values())
+        processed, failed = counts["ok"], counts["failed"]
+        total = processed + failed
         return {
-            "processed": len(self.processed_tickers),
-            "failed": len(self.failed_tickers),
-            "success_rate": len(self.processed_tickers) / 
-                          (len(self.processed_tickers) + len(self.failed_tickers)) 
-                          if (len(self.processed_tickers) + len(self.failed_tickers)) > 0 
-                          else 0
+            "processed": processed,
+            "failed": failed,
+            "success_rate": processed / total if total > 0 else 0
         }
 
+def prefetch_profiles(tickers: List[str], chunk_size: int = 20) -> None:
+    """Warm the profile cache with one comma-separated request per chunk.
+
+    FMP's profile endpoint accepts up to ~20 symbols at once, so N tickers
+    cost N/20 requests here instead of one each during the per-ticker fetch.
+    """
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        data = _fmp_get(f"profile/{','.join(chunk)}")
+        if not data:
+            continue
+        now = time.time()
+        for record in data:
+            symbol = record.get('symbol')
+            if not symbol:
+                continue
+            key = (f"profile/{symbol}", ())
+            entry = {'data': [record], 'timestamp': now}
+            stock_cache[key] = entry
+            append_cache_entry(key, entry)
+
+def prefilter_tickers(tickers: List[str], chunk_size: int = 100) -> List[str]:
+    """Shortlist tickers via the bulk quote endpoint before the deep fetch.
+
+    One quote request covers up to chunk_size symbols and carries a trailing
+    PE, which already decides the screen for most symbols. Conservative by
+    design: a ticker is only dropped when its quoted PE is present and
+    fails the threshold — anything ambiguous goes through to the full fetch.
+    """
+    shortlist = []
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        quotes = _fmp_get(f"quote/{','.join(chunk)}")
+        if not quotes:
+            # Endpoint failure must not silently drop candidates
+            shortlist.extend(chunk)
+            continue
+        pe_by_symbol = {q.get('symbol'): q.get('pe') for q in quotes}
+        for ticker in chunk:
+            pe = pe_by_symbol.get(ticker)
+            if pe is None or pe < THRESHOLDS.pe:
+                shortlist.append(ticker)
+    return shortlist
+
 def fetch_stock_data_batch(tickers: List[str], batch_size: int = BATCH_SIZE) -> Dict[str, Dict]:
     """Fetch data for multiple tickers using efficient batch processing."""
-    processor = BatchProcessor()
     all_results = {}
-    
-    # Split tickers into batches
-    for i in range(0, len(tickers), batch_size):
-        batch = tickers[i:i + batch_size]
-        logging.info(f"Processing batch {i//batch_size + 1} of {(len(tickers) + batch_size - 1)//batch_size}")
-        
-        batch_results = processor.process_batch(batch)
-        all_results.update(batch_results)
-        
-        # Save intermediate results
-        save_cache(all_results)
-        
-        # Log progress
-        stats = processor.get_statistics()
-        logging.info(f"Progress: {stats['processed']} processed, {stats['failed']} failed "
-                    f"({stats['success_rate']*100:.1f}% success rate)")
-    
+
+    # One bulk request per 20 tickers seeds the profile cache up front
+    prefetch_profiles(tickers)
+
+    with BatchProcessor() as processor:
+        # Split tickers into batches
+        for i in range(0, len(tickers), batch_size):
+            batch = tickers[i:i + batch_size]
+            logging.info(f"Processing batch {i//batch_size + 1} of {(len(tickers) + batch_size - 1)//batch_size}")
+
+            batch_results = processor.process_batch(batch)
+            all_results.update(batch_results)
+
+            # Log progress
+            stats = processor.get_statistics()
+            logging.info(f"Progress: {stats['processed']} processed, {stats['failed']} failed "
+                        f"({stats['success_rate']*100:.1f}% success rate)")
+
     return all_results
 
+def iter_stock_data(tickers: List[str], max_workers: int = MAX_WORKERS):
+    """Yield (ticker, data) pairs as fetches complete.
+
+    Streaming alternative to fetch_stock_data_batch for large universes:
+    results are handed to the caller one at a time instead of being
+    accumulated in a dict.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fmp-iter") as executor:
+        futures = {executor.submit(fetch_stock_data, ticker): ticker
+                   for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                logging.error(f"Error fetching data for {ticker}: {e}")
+                continue
+            if data:
+                yield ticker, data
+
+def write_stock_data_jsonl(tickers: List[str], path: str) -> int:
+    """Stream fetched records straight to a JSONL file, one per line.
+
+    Keeps resident memory flat regardless of universe size. Returns the
+    number of records written.
+    """
+    written = 0
+    with open(path, 'wb') as f:
+        for ticker, data in iter_stock_data(tickers):
+            f.write(_dumps({'ticker': ticker, 'data': data}) + b'\n')
+            written += 1
+            if written % 128 == 0:
+                f.flush()
+    return written
+
 def test_fmp_connection() -> bool:
     """
     Test the FMP API connection and data quality using a few well-known stocks.
@@ -566,13 +920,13 @@ def test_value_metrics(ticker: str) -> None:
         "Valuation Metrics": {
             "P/E Ratio": data.get("pe_ratio"),
             "Forward P/E": data.get("forward_pe"),
-            "Price/Book": data.get("price_to_book"),
+            "Price/Book": data.get("price_to_book_ratio"),
             "Price/Sales": data.get("price_to_sales"),
             "Market Cap": data.get("market_cap"),
             "EV/EBITDA": data.get("ev_ebitda")
         },
         "Profitability Metrics": {
-            "ROE": data.get("roe"),
+            "ROE": data.get("roe_ratio"),
             "ROA": data.get("roa"),
             "Net Margin": data.get("net_margin"),
             "Operating Margin": data.get("operating_margin"),
@@ -580,7 +934,7 @@ def test_value_metrics(ticker: str) -> None:
             "EBITDA Margin": data.get("ebitda_margin")
         },
         "Financial Health": {
-            "Debt/Equity": data.get("debt_to_equity"),
+            "Debt/Equity": data.get("de_ratio"),
             "Total Debt": data.get("total_debt"),
             "Total Cash": data.get("total_cash"),
             "Total Equity": data.get("total_equity"),
@@ -658,7 +1012,7 @@ def test_value_metrics(ticker: str) -> None:
     
     # Check if we have enough data for core value analysis
     core_metrics = [
-        "pe_ratio", "price_to_book", "roe", "debt_to_equity", "net_margin",
+        "pe_ratio", "price_to_book_ratio", "roe_ratio", "de_ratio", "net_margin",
         "free_cash_flow", "revenue_growth_ttm", "analyst_rating"
     ]
     missing_core = [m for m in core_metrics if data.get(m) is None]
@@ -672,8 +1026,11 @@ def clear_cache():
     """Clear the cache file and reset the cache dictionary."""
     global stock_cache
     stock_cache = {}
+    _fmp_get_cached.cache_clear()
     if os.path.exists(CACHE_FILE):
         os.remove(CACHE_FILE)
+    if os.path.exists(CACHE_JOURNAL):
+        os.remove(CACHE_JOURNAL)
     logging.info("Cache cleared")
 
 if __name__ == "__main__":
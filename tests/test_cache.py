@@ -0,0 +1,27 @@
+from utils.cache import load_cache, save_cache, get_cache_key
+
+def test_load_missing_file_returns_empty(tmp_path):
+    assert load_cache(str(tmp_path / "nope.json")) == {}
+
+def test_save_and_load_roundtrip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    data = {"key": {"nested": [1, 2.5, "three", None]}}
+    save_cache(data, path)
+    assert load_cache(path) == data
+
+def test_save_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "cache.json"
+    save_cache({"a": 1}, str(path))
+    assert path.exists()
+    assert not (tmp_path / "cache.json.tmp").exists()
+
+def test_cache_key_is_stable():
+    messages = [{"role": "user", "content": "hello"}]
+    assert get_cache_key(messages) == get_cache_key(list(messages))
+    assert get_cache_key(messages) != get_cache_key([{"role": "user", "content": "bye"}])
+
+def test_cache_key_accepts_endpoint_params():
+    # fmp_services hashes [endpoint, params] rather than message dicts
+    key = get_cache_key(["profile/AAPL", {"apikey": "k", "limit": 1}])
+    assert key == get_cache_key(["profile/AAPL", {"limit": 1, "apikey": "k"}])
+    assert key != get_cache_key(["profile/MSFT", {"apikey": "k", "limit": 1}])
@@ -0,0 +1,33 @@
+from analysis.financial_analysis import meets_value_criteria, meets_value_criteria_batch
+
+PASSING = {"pe_ratio": 5.0, "price_to_book_ratio": 1.0, "de_ratio": 0.5, "roe_ratio": 0.2}
+
+def test_meets_value_criteria_passes():
+    assert meets_value_criteria(PASSING)
+
+def test_meets_value_criteria_rejects_high_pe():
+    assert not meets_value_criteria({**PASSING, "pe_ratio": 50.0})
+
+def test_meets_value_criteria_rejects_missing_ratio():
+    data = dict(PASSING)
+    del data["roe_ratio"]
+    assert not meets_value_criteria(data)
+
+def test_meets_value_criteria_rejects_none_ratio():
+    assert not meets_value_criteria({**PASSING, "de_ratio": None})
+
+def test_batch_matches_single():
+    batch = {
+        "GOOD": PASSING,
+        "ZERO_DEBT": {**PASSING, "de_ratio": 0.0},
+        "BAD_PE": {**PASSING, "pe_ratio": 50.0},
+        "MISSING": {k: v for k, v in PASSING.items() if k != "pe_ratio"},
+        "NULL": {**PASSING, "roe_ratio": None},
+    }
+    passed = meets_value_criteria_batch(batch)
+    assert passed == ["GOOD", "ZERO_DEBT"]
+    # Scalar and batch screens must agree on every record
+    assert passed == [t for t, data in batch.items() if meets_value_criteria(data)]
+
+def test_batch_empty():
+    assert meets_value_criteria_batch({}) == []
@@ -1,18 +1,40 @@
-# import the json files
 import json
+import os
 
-# load the json files
-with open('amex_tickers.json', 'r') as f:
-    amex_tickers = json.load(f)
-with open('nasdaq_tickers.json', 'r') as f:
-    nasdaq_tickers = json.load(f)
-with open('nyse_tickers.json', 'r') as f:
-    nyse_tickers = json.load(f)
-
-# Combine and deduplicate
-stock_tickers = list(set(amex_tickers + nasdaq_tickers + nyse_tickers))
-    
-# save the json files
-with open('stock_tickers.json', 'w') as f:
-    json.dump(stock_tickers, f)
+_TICKER_DIR = os.path.dirname(os.path.abspath(__file__))
+_SOURCE_FILES = ('amex_tickers.json', 'nasdaq_tickers.json', 'nyse_tickers.json')
+_UNIVERSE_FILE = 'stock_tickers.json'
 
+
+def build_universe():
+    """Union the per-exchange ticker lists into one sorted universe.
+
+    The combined list is cached in stock_tickers.json and only rebuilt when
+    one of the source files is newer — callers importing this module no
+    longer pay the file I/O on every import. Sorted output keeps the file
+    diff-stable across rebuilds.
+    """
+    universe_path = os.path.join(_TICKER_DIR, _UNIVERSE_FILE)
+    source_paths = [os.path.join(_TICKER_DIR, name) for name in _SOURCE_FILES]
+
+    if os.path.exists(universe_path):
+        universe_mtime = os.path.getmtime(universe_path)
+        if all(os.path.getmtime(p) <= universe_mtime for p in source_paths):
+            with open(universe_path, 'r') as f:
+                return json.load(f)
+
+    # Stream each list into one set instead of concatenating three
+    # temporary lists before hashing
+    seen = set()
+    for path in source_paths:
+        with open(path, 'r') as f:
+            seen.update(json.load(f))
+    tickers = sorted(seen)
+
+    with open(universe_path, 'w') as f:
+        json.dump(tickers, f)
+    return tickers
+
+
+if __name__ == '__main__':
+    print(f"{len(build_universe())} tickers in universe")
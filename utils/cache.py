@@ -2,12 +2,41 @@ import json
 import hashlib
 import os
 
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json when orjson isn't installed
+    orjson = None
+
 def load_cache(cache_file):
-    return json.load(open(cache_file)) if os.path.exists(cache_file) else {}
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, "rb") as f:
+        raw = f.read()
+    if not raw:
+        return {}
+    return orjson.loads(raw) if orjson else json.loads(raw)
 
 def save_cache(cache, cache_file):
-    with open(cache_file, "w") as f:
-        json.dump(cache, f)
+    # Write to a temp file and rename so a crash mid-write can't corrupt the cache
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(cache) if orjson else json.dumps(cache).encode())
+    os.replace(tmp_file, cache_file)
 
-def get_cache_key(messages):
-    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
\ No newline at end of file
+def get_cache_key(parts):
+    # OpenAI message lists are the hot path: stream the role/content fields
+    # straight into the hasher instead of allocating a canonical JSON string
+    # first. Other callers hash arbitrary parts (fmp_services passes
+    # [endpoint, params]); those fall back to canonical JSON per part.
+    # Separator bytes keep field and part boundaries unambiguous; blake2b-128
+    # is ample for key uniqueness with no security requirement here.
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, dict) and "role" in part and "content" in part:
+            h.update(part["role"].encode())
+            h.update(b"\x00")
+            h.update(part["content"].encode())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b"\x01")
+    return h.hexdigest()
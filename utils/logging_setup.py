@@ -1,9 +1,14 @@
 import logging
 
 def setup_logging():
-    logging.basicConfig(
-        filename='stock_selection.log',
-        level=logging.INFO,
-        format='%(asctime)s %(levelname)s %(message)s'
-    )
-    logging.getLogger().addHandler(logging.StreamHandler())
\ No newline at end of file
+    root = logging.getLogger()
+    # Calling this twice (tests do) must not stack duplicate handlers —
+    # every extra handler formats and writes each record again
+    if root.handlers:
+        return
+    root.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    file_handler = logging.FileHandler('stock_selection.log')
+    file_handler.setFormatter(formatter)
+    root.addHandler(file_handler)
+    root.addHandler(logging.StreamHandler())